@@ -342,6 +342,8 @@ def render_image_with_occgrid_test(
         ).expand(num_rays, n_grids * 2)
 
     opc_thre = 1 - early_stop_eps
+    # repacked if `estimator.binaries` has changed since the last packing.
+    binaries_packed = estimator._get_binaries_packed()
 
     while iter_samples < max_samples:
         n_alive = ray_mask.sum().item()
@@ -372,6 +374,8 @@ def render_image_with_occgrid_test(
             t_sorted,  # [n_rays, m*2]
             t_indices,  # [n_rays, m*2]
             hits,  # [n_rays, m]
+            # pre-packed grids
+            binaries_packed,  # [m, resx, resy, ceil(resz / 32)]
         )
         t_starts = intervals.vals[intervals.is_left]
         t_ends = intervals.vals[intervals.is_right]
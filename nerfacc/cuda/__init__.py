@@ -21,6 +21,9 @@ RaySegmentsSpec = _make_lazy_cuda_func("RaySegmentsSpec")
 # grid
 ray_aabb_intersect = _make_lazy_cuda_func("ray_aabb_intersect")
 traverse_grids = _make_lazy_cuda_func("traverse_grids")
+grid_cell_positions = _make_lazy_cuda_func("grid_cell_positions")
+grid_ema_update = _make_lazy_cuda_func("grid_ema_update")
+pack_binaries = _make_lazy_cuda_func("pack_binaries")
 
 # scan
 inclusive_sum = _make_lazy_cuda_func("inclusive_sum")
@@ -45,6 +48,7 @@ exclusive_prod_cub_backward = _make_lazy_cuda_func(
 # pdf
 importance_sampling = _make_lazy_cuda_func("importance_sampling")
 searchsorted = _make_lazy_cuda_func("searchsorted")
+density_to_cdf = _make_lazy_cuda_func("density_to_cdf")
 
 # camera
 opencv_lens_undistortion = _make_lazy_cuda_func("opencv_lens_undistortion")
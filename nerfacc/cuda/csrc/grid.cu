@@ -36,7 +36,9 @@ About rays:
 About voxel grids:
     We support ray traversal through one or more voxel grids (n_grids). Each grid is defined
     by an axis-aligned AABB (aabbs), and a binary occupancy grid (binaries) with resolution of
-    {resx, resy, resz}. Currently, we assume all grids have the same resolution. Note the ordering
+    {resx, resy, resz}. The binary grids are bit-packed along z: every int32 word holds the 
+    occupancy of 32 consecutive voxels, i.e., voxel (x, y, z) is the (z & 31)-th bit of
+    binaries[level, x, y, z >> 5]. Currently, we assume all grids have the same resolution. Note the ordering
     of the grids is important when there are overlapping grids, because we assume the grid in front
     has higher priority when examing occupancy status (e.g., the first grid's occupancy status
     will overwrite the second grid's occupancy status if they overlap).
@@ -74,8 +76,8 @@ __global__ void traverse_grids_kernel(
     // grids
     int32_t n_grids,
     int3 resolution,
-    bool *binaries, // [n_grids, resx, resy, resz]
-    float *aabbs,   // [n_grids, 6]
+    int32_t *binaries, // [n_grids, resx, resy, ceil(resz / 32)]
+    float *aabbs,      // [n_grids, 6]
     // sorted intersections
     bool *hits,         // [n_rays, n_grids]
     float *t_sorted,    // [n_rays, n_grids * 2]
@@ -126,6 +128,12 @@ __global__ void traverse_grids_kernel(
         int64_t n_samples = 0;
         float t_last = near_plane;
         bool continuous = false;
+
+        // the last loaded word of the bit-packed binaries. Consecutive cells
+        // along z share the same word so we only reload it when it changes.
+        const int32_t n_words = ceil_div<int32_t>(resolution.z, 32);
+        int64_t word_id = -1;
+        uint32_t word = 0;
         for (int32_t i = base_t_sorted; i < base_t_sorted + n_grids * 2 - 1; i++) {
             // whether this is the entering or leaving for this level of grid.
             bool is_entering = t_indices[i] < n_grids;
@@ -184,14 +192,18 @@ __global__ void traverse_grids_kernel(
             while (traverse_steps_limit <= 0 || n_samples < traverse_steps_limit) {
                 float t_traverse = min(tdist.x, min(tdist.y, tdist.z));
                 t_traverse = fminf(t_traverse, this_tmax);
-                int64_t cell_id = (
-                    current_index.x * resolution.y * resolution.z
-                    + current_index.y * resolution.z
-                    + current_index.z
-                    + level * resolution.x * resolution.y * resolution.z
+                int64_t this_word_id = (
+                    current_index.x * resolution.y * n_words
+                    + current_index.y * n_words
+                    + (current_index.z >> 5)
+                    + level * resolution.x * resolution.y * n_words
                 );
+                if (this_word_id != word_id) {
+                    word_id = this_word_id;
+                    word = (uint32_t)binaries[word_id];
+                }
 
-                if (!binaries[cell_id]) {
+                if (!((word >> (current_index.z & 31)) & 1u)) {
                     // skip the cell that is empty.
                     if (step_size <= 0.0f) { // march to t_traverse.
                         t_last = t_traverse;
@@ -313,6 +325,155 @@ __global__ void ray_aabb_intersect_kernel(
 }
 
 
+/* kernels for updating the occupancy grid */
+__global__ void grid_cell_positions_kernel(
+    // cells
+    const int64_t n_cells,
+    const int64_t *cell_ids,  // [n_cells] flattened ids across all grids
+    // grids
+    const int3 resolution,
+    float *aabbs,             // [n_grids, 6]
+    // jittering
+    at::PhiloxCudaState philox_args,
+    // outputs
+    float *positions)         // [n_cells, 3]
+{
+    const int64_t cells_per_grid = (int64_t)resolution.x * resolution.y * resolution.z;
+    const float3 res = make_float3(resolution);
+
+    // parallelize over cells
+    for (int64_t tid = blockIdx.x * blockDim.x + threadIdx.x; tid < n_cells; tid += blockDim.x * gridDim.x)
+    {
+        int64_t cell_id = cell_ids[tid];
+        int64_t level = cell_id / cells_per_grid;
+        int64_t index = cell_id - level * cells_per_grid;
+        int3 coord = make_int3(
+            index / (resolution.y * resolution.z),
+            (index / resolution.z) % resolution.y,
+            index % resolution.z);
+
+        // uniformly jitter within the voxel.
+        auto seeds = at::cuda::philox::unpack(philox_args);
+        curandStatePhilox4_32_10_t state;
+        curand_init(std::get<0>(seeds), tid, std::get<1>(seeds), &state);
+        float4 u = curand_uniform4(&state);
+
+        // voxel coordinates [0, 1]^3 -> world
+        AABBSpec aabb = AABBSpec(aabbs + level * 6);
+        float3 x = (make_float3(coord) + make_float3(u)) / res;
+        x = aabb.min + x * (aabb.max - aabb.min);
+
+        positions[tid * 3] = x.x;
+        positions[tid * 3 + 1] = x.y;
+        positions[tid * 3 + 2] = x.z;
+    }
+}
+
+// Atomic `*addr = max(*addr, val)` for floats, via the integer ordering of
+// IEEE 754: non-negative floats order as signed ints, negative ones in reverse
+// as unsigned ints.
+inline __device__ void atomic_fmax(float *addr, float val) {
+    if (val >= 0.f)
+        atomicMax(reinterpret_cast<int *>(addr), __float_as_int(val));
+    else
+        atomicMin(reinterpret_cast<unsigned int *>(addr), __float_as_uint(val));
+}
+
+// Atomic `*addr = max(*addr, val)` for doubles, via a 64-bit CAS loop.
+inline __device__ void atomic_fmax(double *addr, float val) {
+    unsigned long long *word = reinterpret_cast<unsigned long long *>(addr);
+    unsigned long long old = *word, assumed;
+    do {
+        assumed = old;
+        if (__longlong_as_double(assumed) >= val) break;
+        old = atomicCAS(word, assumed, __double_as_longlong(static_cast<double>(val)));
+    } while (assumed != old);
+}
+
+// Atomic `*addr = max(*addr, val)` for 16-bit floats (at::Half, at::BFloat16),
+// via a CAS loop on the 32-bit word that contains `addr`.
+template <typename scalar_t>
+inline __device__ void atomic_fmax(scalar_t *addr, float val) {
+    unsigned int *word = reinterpret_cast<unsigned int *>(
+        reinterpret_cast<size_t>(addr) & ~static_cast<size_t>(2));
+    const bool high = reinterpret_cast<size_t>(addr) & 2;
+    unsigned int old = *word, assumed;
+    do {
+        assumed = old;
+        unsigned short bits = high ? (assumed >> 16) : (assumed & 0xffffu);
+        if (static_cast<float>(scalar_t(bits, scalar_t::from_bits())) >= val) break;
+        unsigned int new_bits = scalar_t(val).x;
+        unsigned int updated = high 
+            ? ((assumed & 0x0000ffffu) | (new_bits << 16)) 
+            : ((assumed & 0xffff0000u) | new_bits);
+        old = atomicCAS(word, assumed, updated);
+    } while (assumed != old);
+}
+
+template <typename scalar_t>
+__global__ void grid_ema_decay_kernel(
+    const int64_t n_cells,
+    const int64_t *cell_ids, // [n_cells]
+    const float ema_decay,
+    // outputs
+    int32_t *visited,        // [ceil(n_grids * resx * resy * resz / 32)] bit mask
+    scalar_t *occs)          // [n_grids * resx * resy * resz]
+{
+    // parallelize over cells
+    for (int64_t tid = blockIdx.x * blockDim.x + threadIdx.x; tid < n_cells; tid += blockDim.x * gridDim.x)
+    {
+        int64_t cell_id = cell_ids[tid];
+        if (cell_id < 0) continue;  // padded cell
+        // decay each cell only once even if it appears multiple times.
+        uint32_t bit = 1u << (cell_id & 31);
+        uint32_t old = atomicOr(reinterpret_cast<unsigned int *>(visited + (cell_id >> 5)), bit);
+        if (old & bit) continue;
+        // compute in fp32 regardless of the storage type of `occs`.
+        occs[cell_id] = static_cast<scalar_t>(static_cast<float>(occs[cell_id]) * ema_decay);
+    }
+}
+
+template <typename scalar_t>
+__global__ void grid_ema_max_kernel(
+    const int64_t n_cells,
+    const int64_t *cell_ids, // [n_cells]
+    const float *occ,        // [n_cells]
+    // outputs
+    scalar_t *occs)          // [n_grids * resx * resy * resz]
+{
+    // parallelize over cells
+    for (int64_t tid = blockIdx.x * blockDim.x + threadIdx.x; tid < n_cells; tid += blockDim.x * gridDim.x)
+    {
+        int64_t cell_id = cell_ids[tid];
+        if (cell_id < 0) continue;  // padded cell
+        atomic_fmax(occs + cell_id, occ[tid]);
+    }
+}
+
+
+__global__ void pack_binaries_kernel(
+    const int64_t n_words,
+    const int32_t resz,
+    const int32_t n_words_per_row,
+    const bool *binaries,      // [n_grids * resx * resy, resz]
+    // outputs
+    int32_t *binaries_packed)  // [n_grids * resx * resy, ceil(resz / 32)]
+{
+    // parallelize over words
+    for (int64_t tid = blockIdx.x * blockDim.x + threadIdx.x; tid < n_words; tid += blockDim.x * gridDim.x)
+    {
+        int64_t row = tid / n_words_per_row;
+        int32_t z0 = (tid % n_words_per_row) * 32;
+        int32_t n_bits = min(32, resz - z0);
+
+        const bool *bits = binaries + row * resz + z0;
+        uint32_t word = 0u;
+        for (int32_t i = 0; i < n_bits; ++i)
+            word |= static_cast<uint32_t>(bits[i]) << i;
+        binaries_packed[tid] = static_cast<int32_t>(word);
+    }
+}
+
 }  // namespace device
 }  // namespace
 
@@ -323,7 +484,8 @@ std::tuple<RaySegmentsSpec, RaySegmentsSpec, torch::Tensor> traverse_grids(
     const torch::Tensor rays_d, // [n_rays, 3]
     const torch::Tensor rays_mask,   // [n_rays]
     // grids
-    const torch::Tensor binaries,  // [n_grids, resx, resy, resz]
+    const torch::Tensor binaries,  // [n_grids, resx, resy, ceil(resz / 32)] bit-packed
+    const int32_t resz,
     const torch::Tensor aabbs,     // [n_grids, 6]
     // intersections
     const torch::Tensor t_sorted,  // [n_rays, n_grids]
@@ -345,9 +507,12 @@ std::tuple<RaySegmentsSpec, RaySegmentsSpec, torch::Tensor> traverse_grids(
         TORCH_CHECK(traverse_steps_limit > 0, "traverse_steps_limit must be > 0 when over_allocate is true");
     }
 
+    TORCH_CHECK(binaries.scalar_type() == torch::kInt32, "binaries must be bit-packed into int32");
+    TORCH_CHECK(binaries.size(3) == ceil_div<int32_t>(resz, 32), "binaries must be bit-packed along z");
+
     int32_t n_rays = rays_o.size(0);
     int32_t n_grids = binaries.size(0);
-    int3 resolution = make_int3(binaries.size(1), binaries.size(2), binaries.size(3));
+    int3 resolution = make_int3(binaries.size(1), binaries.size(2), resz);
 
     at::cuda::CUDAStream stream = at::cuda::getCurrentCUDAStream();
     int32_t max_threads = 512; 
@@ -381,7 +546,7 @@ std::tuple<RaySegmentsSpec, RaySegmentsSpec, torch::Tensor> traverse_grids(
             // grids
             n_grids,
             resolution,
-            binaries.data_ptr<bool>(), // [n_grids, resx, resy, resz]
+            binaries.data_ptr<int32_t>(), // [n_grids, resx, resy, ceil(resz / 32)]
             aabbs.data_ptr<float>(),   // [n_grids, 6]
             // sorted intersections
             hits.data_ptr<bool>(),         // [n_rays, n_grids]
@@ -419,7 +584,7 @@ std::tuple<RaySegmentsSpec, RaySegmentsSpec, torch::Tensor> traverse_grids(
             // grids
             n_grids,
             resolution,
-            binaries.data_ptr<bool>(), // [n_grids, resx, resy, resz]
+            binaries.data_ptr<int32_t>(), // [n_grids, resx, resy, ceil(resz / 32)]
             aabbs.data_ptr<float>(),   // [n_grids, 6]
             // sorted intersections
             hits.data_ptr<bool>(),         // [n_rays, n_grids]
@@ -451,7 +616,7 @@ std::tuple<RaySegmentsSpec, RaySegmentsSpec, torch::Tensor> traverse_grids(
             // grids
             n_grids,
             resolution,
-            binaries.data_ptr<bool>(), // [n_grids, resx, resy, resz]
+            binaries.data_ptr<int32_t>(), // [n_grids, resx, resy, ceil(resz / 32)]
             aabbs.data_ptr<float>(),   // [n_grids, 6]
             // sorted intersections
             hits.data_ptr<bool>(),         // [n_rays, n_grids]
@@ -517,3 +682,130 @@ std::vector<torch::Tensor> ray_aabb_intersect(
 
     return {t_mins, t_maxs, hits};
 }
+
+
+torch::Tensor grid_cell_positions(
+    const torch::Tensor cell_ids,  // [n_cells]
+    const torch::Tensor aabbs,     // [n_grids, 6]
+    const std::vector<int64_t> resolution)  // {resx, resy, resz}
+{
+    DEVICE_GUARD(cell_ids);
+    CHECK_INPUT(cell_ids);
+    CHECK_INPUT(aabbs);
+    TORCH_CHECK(resolution.size() == 3, "resolution must have 3 elements");
+
+    int64_t n_cells = cell_ids.numel();
+    torch::Tensor positions = torch::empty({n_cells, 3}, aabbs.options());
+    if (n_cells == 0) return positions;
+
+    at::cuda::CUDAStream stream = at::cuda::getCurrentCUDAStream();
+    int64_t max_threads = 512; 
+    int64_t max_blocks = 65535;
+    dim3 threads = dim3(min(max_threads, n_cells));
+    dim3 blocks = dim3(min(max_blocks, ceil_div<int64_t>(n_cells, threads.x)));
+
+    // For jittering
+    auto gen = at::get_generator_or_default<at::CUDAGeneratorImpl>(
+        c10::nullopt, at::cuda::detail::getDefaultCUDAGenerator());
+    at::PhiloxCudaState rng_engine_inputs;
+    {
+      // See Note [Acquire lock when using random generators]
+      std::lock_guard<std::mutex> lock(gen->mutex_);
+      rng_engine_inputs = gen->philox_cuda_state(4);
+    }
+
+    device::grid_cell_positions_kernel<<<blocks, threads, 0, stream>>>(
+        // cells
+        n_cells,
+        cell_ids.data_ptr<int64_t>(),  // [n_cells]
+        // grids
+        make_int3(resolution[0], resolution[1], resolution[2]),
+        aabbs.data_ptr<float>(),       // [n_grids, 6]
+        // jittering
+        rng_engine_inputs,
+        // outputs
+        positions.data_ptr<float>());  // [n_cells, 3]
+
+    return positions;
+}
+
+
+void grid_ema_update(
+    torch::Tensor occs,            // [n_grids * resx * resy * resz]
+    const torch::Tensor cell_ids,  // [n_cells]
+    const torch::Tensor occ,       // [n_cells]
+    const float ema_decay)
+{
+    DEVICE_GUARD(occs);
+    CHECK_INPUT(occs);
+    CHECK_INPUT(cell_ids);
+    CHECK_INPUT(occ);
+    TORCH_CHECK(cell_ids.numel() == occ.numel());
+    TORCH_CHECK(occ.scalar_type() == torch::kFloat32, "occ must be float32");
+
+    int64_t n_cells = cell_ids.numel();
+    if (n_cells == 0) return;
+
+    at::cuda::CUDAStream stream = at::cuda::getCurrentCUDAStream();
+    int64_t max_threads = 512; 
+    int64_t max_blocks = 65535;
+    dim3 threads = dim3(min(max_threads, n_cells));
+    dim3 blocks = dim3(min(max_blocks, ceil_div<int64_t>(n_cells, threads.x)));
+
+    // marks the cells that have been decayed, in case of duplicated cell_ids.
+    torch::Tensor visited = torch::zeros(
+        {ceil_div<int64_t>(occs.numel(), 32)}, occs.options().dtype(torch::kInt32));
+
+    AT_DISPATCH_FLOATING_TYPES_AND2(
+        at::ScalarType::Half, at::ScalarType::BFloat16,
+        occs.scalar_type(), "grid_ema_update", ([&] {
+            device::grid_ema_decay_kernel<scalar_t><<<blocks, threads, 0, stream>>>(
+                n_cells,
+                cell_ids.data_ptr<int64_t>(),  // [n_cells]
+                ema_decay,
+                // outputs
+                visited.data_ptr<int32_t>(),
+                occs.data_ptr<scalar_t>());    // [n_grids * resx * resy * resz]
+            device::grid_ema_max_kernel<scalar_t><<<blocks, threads, 0, stream>>>(
+                n_cells,
+                cell_ids.data_ptr<int64_t>(),  // [n_cells]
+                occ.data_ptr<float>(),         // [n_cells]
+                // outputs
+                occs.data_ptr<scalar_t>());    // [n_grids * resx * resy * resz]
+        }));
+}
+
+
+// Bit-pack the binary grids along z into int32 words, inplace into `binaries_packed`.
+void pack_binaries(
+    const torch::Tensor binaries,   // [n_grids, resx, resy, resz]
+    torch::Tensor binaries_packed)  // [n_grids, resx, resy, ceil(resz / 32)]
+{
+    DEVICE_GUARD(binaries);
+    CHECK_INPUT(binaries);
+    CHECK_INPUT(binaries_packed);
+    TORCH_CHECK(binaries.ndimension() == 4);
+    TORCH_CHECK(binaries.scalar_type() == torch::kBool, "binaries must be bool");
+    TORCH_CHECK(binaries_packed.scalar_type() == torch::kInt32, "binaries_packed must be int32");
+    
+    int32_t resz = binaries.size(3);
+    int32_t n_words_per_row = ceil_div<int32_t>(resz, 32);
+    TORCH_CHECK(binaries_packed.numel() == binaries.numel() / resz * n_words_per_row);
+
+    int64_t n_words = binaries_packed.numel();
+    if (n_words == 0) return;
+
+    at::cuda::CUDAStream stream = at::cuda::getCurrentCUDAStream();
+    int64_t max_threads = 512; 
+    int64_t max_blocks = 65535;
+    dim3 threads = dim3(min(max_threads, n_words));
+    dim3 blocks = dim3(min(max_blocks, ceil_div<int64_t>(n_words, threads.x)));
+
+    device::pack_binaries_kernel<<<blocks, threads, 0, stream>>>(
+        n_words,
+        resz,
+        n_words_per_row,
+        binaries.data_ptr<bool>(),
+        // outputs
+        binaries_packed.data_ptr<int32_t>());
+}
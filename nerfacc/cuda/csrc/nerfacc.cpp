@@ -78,7 +78,8 @@ std::tuple<RaySegmentsSpec, RaySegmentsSpec, torch::Tensor> traverse_grids(
     const torch::Tensor rays_d, // [n_rays, 3]
     const torch::Tensor rays_mask,   // [n_rays]
     // grids
-    const torch::Tensor binaries,  // [n_grids, resx, resy, resz]
+    const torch::Tensor binaries,  // [n_grids, resx, resy, ceil(resz / 32)] bit-packed
+    const int32_t resz,
     const torch::Tensor aabbs,     // [n_grids, 6]
     // intersections
     const torch::Tensor t_sorted,  // [n_rays, n_grids * 2]
@@ -94,6 +95,18 @@ std::tuple<RaySegmentsSpec, RaySegmentsSpec, torch::Tensor> traverse_grids(
     const bool compute_terminate_planes,
     const int32_t traverse_steps_limit, // <= 0 means no limit
     const bool over_allocate); // over allocate the memory for intervals and samples
+torch::Tensor grid_cell_positions(
+    const torch::Tensor cell_ids,  // [n_cells]
+    const torch::Tensor aabbs,     // [n_grids, 6]
+    const std::vector<int64_t> resolution);  // {resx, resy, resz}
+void grid_ema_update(
+    torch::Tensor occs,            // [n_grids * resx * resy * resz]
+    const torch::Tensor cell_ids,  // [n_cells]
+    const torch::Tensor occ,       // [n_cells]
+    const float ema_decay);
+void pack_binaries(
+    const torch::Tensor binaries,   // [n_grids, resx, resy, resz]
+    torch::Tensor binaries_packed); // [n_grids, resx, resy, ceil(resz / 32)]
 
 // pdf
 std::vector<RaySegmentsSpec> importance_sampling(
@@ -106,9 +119,21 @@ std::vector<RaySegmentsSpec> importance_sampling(
     torch::Tensor cdfs,                  
     int64_t n_intervels_per_ray,
     bool stratified);
+std::vector<RaySegmentsSpec> importance_sampling(
+    RaySegmentsSpec ray_segments,
+    torch::Tensor cdfs,
+    int64_t n_intervels_per_ray,
+    bool stratified,
+    torch::Tensor intervals_vals,
+    torch::Tensor samples_vals);
 std::vector<torch::Tensor> searchsorted(
     RaySegmentsSpec query,
     RaySegmentsSpec key);
+void density_to_cdf(
+    const torch::Tensor t_starts,  // [n_rays, n_samples]
+    const torch::Tensor t_ends,    // [n_rays, n_samples]
+    const torch::Tensor sigmas,    // [n_rays, n_samples]
+    torch::Tensor cdfs);           // [n_rays, n_samples + 1]
 
 // cameras
 torch::Tensor opencv_lens_undistortion(
@@ -142,7 +167,11 @@ PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
 
     _REG_FUNC(ray_aabb_intersect);
     _REG_FUNC(traverse_grids);
+    _REG_FUNC(grid_cell_positions);
+    _REG_FUNC(grid_ema_update);
+    _REG_FUNC(pack_binaries);
     _REG_FUNC(searchsorted);
+    _REG_FUNC(density_to_cdf);
 
     _REG_FUNC(opencv_lens_undistortion);
     _REG_FUNC(opencv_lens_undistortion_fisheye);  // TODO: check this function.
@@ -150,6 +179,7 @@ PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
 
     m.def("importance_sampling", py::overload_cast<RaySegmentsSpec, torch::Tensor, torch::Tensor, bool>(&importance_sampling));
     m.def("importance_sampling", py::overload_cast<RaySegmentsSpec, torch::Tensor, int64_t, bool>(&importance_sampling));
+    m.def("importance_sampling", py::overload_cast<RaySegmentsSpec, torch::Tensor, int64_t, bool, torch::Tensor, torch::Tensor>(&importance_sampling));
 
     py::class_<RaySegmentsSpec>(m, "RaySegmentsSpec")
         .def(py::init<>())
@@ -286,6 +286,54 @@ __global__ void searchsorted_kernel(
 }
 
 
+
+/* kernels for density_to_cdf */
+// One warp per ray: the warp scans `sigma * dt` over chunks of 32 samples and
+// writes `cdf = 1 - exp(-exclusive_sum)` on the fly, with `cdf[-1] = 1`.
+__global__ void density_to_cdf_kernel(
+    const int64_t n_rays,
+    const int64_t n_samples,
+    const float *t_starts,  // [n_rays, n_samples] with row stride
+    const float *t_ends,    // [n_rays, n_samples] with row stride
+    const float *sigmas,    // [n_rays, n_samples] with row stride
+    const int64_t t_starts_stride,
+    const int64_t t_ends_stride,
+    const int64_t sigmas_stride,
+    // outputs
+    float *cdfs)  // [n_rays, n_samples + 1]
+{
+    const uint32_t lane = threadIdx.x;
+    for (int64_t ray_id = blockIdx.x * blockDim.y + threadIdx.y; ray_id < n_rays; ray_id += blockDim.y * gridDim.x)
+    {
+        const float *ray_t_starts = t_starts + ray_id * t_starts_stride;
+        const float *ray_t_ends = t_ends + ray_id * t_ends_stride;
+        const float *ray_sigmas = sigmas + ray_id * sigmas_stride;
+        float *ray_cdfs = cdfs + ray_id * (n_samples + 1);
+
+        // sum of sigma * dt over all the previous chunks.
+        float total = 0.f;
+        for (int64_t chunk = 0; chunk < n_samples; chunk += 32) {
+            const int64_t i = chunk + lane;
+            float val = 0.f;
+            if (i < n_samples)
+                val = ray_sigmas[i] * (ray_t_ends[i] - ray_t_starts[i]);
+
+            // inclusive scan within the warp.
+            float scan = val;
+            for (uint32_t offset = 1; offset < 32; offset <<= 1) {
+                float other = __shfl_up_sync(0xffffffff, scan, offset);
+                if (lane >= offset) scan += other;
+            }
+            if (i < n_samples)
+                ray_cdfs[i] = 1.f - expf(-(total + scan - val));
+            total += __shfl_sync(0xffffffff, scan, 31);
+        }
+        if (lane == 0)
+            ray_cdfs[n_samples] = 1.f;
+    }
+}
+
+
 }  // namespace device
 }  // namespace
 
@@ -356,16 +404,29 @@ std::vector<RaySegmentsSpec> importance_sampling(
 
 
 // Return batched RaySegmentsSpec because n_intervels_per_ray is same across rays.
+// The results are written into the preallocated `intervals_vals` and `samples_vals`.
 std::vector<RaySegmentsSpec> importance_sampling(
     RaySegmentsSpec ray_segments,       // [..., n_edges_per_ray] or flattend
     torch::Tensor cdfs,                 // [..., n_edges_per_ray] or flattend 
     int64_t n_intervels_per_ray,       
-    bool stratified)  
+    bool stratified,
+    torch::Tensor intervals_vals,       // [..., n_intervels_per_ray + 1] or [n_rays, n_intervels_per_ray + 1]
+    torch::Tensor samples_vals)         // [..., n_intervels_per_ray] or [n_rays, n_intervels_per_ray]
 {
     DEVICE_GUARD(cdfs);
     ray_segments.check();
     CHECK_INPUT(cdfs);
+    CHECK_INPUT(intervals_vals);
+    CHECK_INPUT(samples_vals);
     TORCH_CHECK(cdfs.numel() == ray_segments.vals.numel());
+    TORCH_CHECK(intervals_vals.scalar_type() == torch::kFloat32 && samples_vals.scalar_type() == torch::kFloat32);
+    TORCH_CHECK(samples_vals.size(-1) == n_intervels_per_ray);
+    TORCH_CHECK(intervals_vals.size(-1) == n_intervels_per_ray + 1);
+    TORCH_CHECK(samples_vals.numel() / n_intervels_per_ray == intervals_vals.numel() / (n_intervels_per_ray + 1));
+    if (ray_segments.vals.ndimension() > 1)
+        TORCH_CHECK(samples_vals.numel() / n_intervels_per_ray == ray_segments.vals.numel() / ray_segments.vals.size(-1));
+    else
+        TORCH_CHECK(samples_vals.numel() / n_intervels_per_ray == ray_segments.chunk_cnts.numel());
 
     at::cuda::CUDAStream stream = at::cuda::getCurrentCUDAStream();
     int64_t max_threads = 512; // at::cuda::getCurrentDeviceProperties()->maxThreadsPerBlock;
@@ -383,17 +444,8 @@ std::vector<RaySegmentsSpec> importance_sampling(
     }
 
     RaySegmentsSpec samples, intervals;
-    if (ray_segments.vals.ndimension() > 1){  // batched input
-        auto data_size = ray_segments.vals.sizes().vec();
-        data_size.back() = n_intervels_per_ray;
-        samples.vals = torch::empty(data_size, cdfs.options());
-        data_size.back() = n_intervels_per_ray + 1;
-        intervals.vals = torch::empty(data_size, cdfs.options());
-    } else { // flattend input
-        int64_t n_rays = ray_segments.chunk_cnts.numel();
-        samples.vals = torch::empty({n_rays, n_intervels_per_ray}, cdfs.options());
-        intervals.vals = torch::empty({n_rays, n_intervels_per_ray + 1}, cdfs.options());
-    }
+    samples.vals = samples_vals;
+    intervals.vals = intervals_vals;
     int64_t n_samples = samples.vals.numel();
     
     // step 1. compute the ray_indices and samples
@@ -421,6 +473,30 @@ std::vector<RaySegmentsSpec> importance_sampling(
 }
 
 
+// Same as above but allocates the outputs.
+std::vector<RaySegmentsSpec> importance_sampling(
+    RaySegmentsSpec ray_segments,       // [..., n_edges_per_ray] or flattend
+    torch::Tensor cdfs,                 // [..., n_edges_per_ray] or flattend 
+    int64_t n_intervels_per_ray,       
+    bool stratified)  
+{
+    torch::Tensor intervals_vals, samples_vals;
+    if (ray_segments.vals.ndimension() > 1){  // batched input
+        auto data_size = ray_segments.vals.sizes().vec();
+        data_size.back() = n_intervels_per_ray;
+        samples_vals = torch::empty(data_size, cdfs.options());
+        data_size.back() = n_intervels_per_ray + 1;
+        intervals_vals = torch::empty(data_size, cdfs.options());
+    } else { // flattend input
+        int64_t n_rays = ray_segments.chunk_cnts.numel();
+        samples_vals = torch::empty({n_rays, n_intervels_per_ray}, cdfs.options());
+        intervals_vals = torch::empty({n_rays, n_intervels_per_ray + 1}, cdfs.options());
+    }
+    return importance_sampling(
+        ray_segments, cdfs, n_intervels_per_ray, stratified, intervals_vals, samples_vals);
+}
+
+
 // Find two indices {left, right} for each item in query,
 // such that: key.vals[left] <= query.vals < key.vals[right]
 std::vector<torch::Tensor> searchsorted(
@@ -454,3 +530,48 @@ std::vector<torch::Tensor> searchsorted(
 
     return {ids_left, ids_right};
 }
+
+
+// Fused `1 - cat([exp(-exclusive_sum(sigmas * dt)), 0])` for batched samples.
+// The results are written inplace into `cdfs`.
+void density_to_cdf(
+    const torch::Tensor t_starts,  // [n_rays, n_samples]
+    const torch::Tensor t_ends,    // [n_rays, n_samples]
+    const torch::Tensor sigmas,    // [n_rays, n_samples]
+    torch::Tensor cdfs)            // [n_rays, n_samples + 1]
+{
+    DEVICE_GUARD(sigmas);
+    CHECK_CUDA(t_starts);
+    CHECK_CUDA(t_ends);
+    CHECK_CUDA(sigmas);
+    CHECK_INPUT(cdfs);
+    TORCH_CHECK(sigmas.ndimension() == 2);
+    TORCH_CHECK(t_starts.sizes() == sigmas.sizes());
+    TORCH_CHECK(t_ends.sizes() == sigmas.sizes());
+    TORCH_CHECK(t_starts.stride(1) == 1 && t_ends.stride(1) == 1 && sigmas.stride(1) == 1,
+                "Samples of each ray must be contiguous.");
+    TORCH_CHECK(t_starts.scalar_type() == at::kFloat && t_ends.scalar_type() == at::kFloat &&
+                sigmas.scalar_type() == at::kFloat && cdfs.scalar_type() == at::kFloat);
+    TORCH_CHECK(cdfs.size(0) == sigmas.size(0) && cdfs.size(1) == sigmas.size(1) + 1);
+
+    int64_t n_rays = sigmas.size(0);
+    int64_t n_samples = sigmas.size(1);
+    if (n_rays == 0) return;
+
+    at::cuda::CUDAStream stream = at::cuda::getCurrentCUDAStream();
+    int64_t max_blocks = 65535;
+    dim3 threads = dim3(32, 16);
+    dim3 blocks = dim3(min(max_blocks, ceil_div<int64_t>(n_rays, threads.y)));
+
+    device::density_to_cdf_kernel<<<blocks, threads, 0, stream>>>(
+        n_rays,
+        n_samples,
+        t_starts.data_ptr<float>(),
+        t_ends.data_ptr<float>(),
+        sigmas.data_ptr<float>(),
+        t_starts.stride(0),
+        t_ends.stride(0),
+        sigmas.stride(0),
+        // outputs
+        cdfs.data_ptr<float>());
+}
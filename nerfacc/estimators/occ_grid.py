@@ -1,9 +1,19 @@
-from typing import Callable, List, Optional, Tuple, Union
+import functools
+from typing import Any, Callable, List, Optional, Tuple, Union
 
 import torch
 from torch import Tensor
 
-from ..grid import _enlarge_aabb, traverse_grids
+from ..grid import (
+    _enlarge_aabb,
+    _grid_cell_positions,
+    _grid_ema_update_,
+    _pack_binaries,
+    _pack_binaries_,
+    ray_aabb_intersect,
+    traverse_grids,
+)
+from ..pack import pack_info
 from ..volrend import (
     render_visibility_from_alpha,
     render_visibility_from_density,
@@ -22,6 +32,10 @@ class OccGridEstimator(AbstractEstimator):
         resolution: The resolution of the grid. If an integer is given, the grid is assumed to
             be a cube. Otherwise, a list or a tensor of shape (3,) is expected. Default: 128.
         levels: The number of levels of the grid. Default: 1.
+        occs_dtype: The storage type of the occupancy values. The EMA update is
+            computed in fp32 either way, so the half-precision types only lose
+            precision that does not matter for thresholding, and halve the
+            memory traffic of the update. Default: torch.bfloat16.
     """
 
     DIM: int = 3
@@ -31,6 +45,7 @@ class OccGridEstimator(AbstractEstimator):
         roi_aabb: Union[List[int], Tensor],
         resolution: Union[int, List[int], Tensor] = 128,
         levels: int = 1,
+        occs_dtype: torch.dtype = torch.bfloat16,
         **kwargs,
     ) -> None:
         super().__init__()
@@ -66,21 +81,80 @@ class OccGridEstimator(AbstractEstimator):
         # Buffers
         self.register_buffer("resolution", resolution)  # [3]
         self.register_buffer("aabbs", aabbs)  # [n_aabbs, 6]
+        # aabbs as an affine map from [0, 1]^3 to world, derived from `aabbs`.
+        self.register_buffer("aabb_lo", aabbs[:, :3].clone(), persistent=False)
+        self.register_buffer(
+            "aabb_scale", aabbs[:, 3:] - aabbs[:, :3], persistent=False
+        )
         self.register_buffer(
-            "occs", torch.zeros(self.levels * self.cells_per_lvl)
+            "occs",
+            torch.zeros(self.levels * self.cells_per_lvl, dtype=occs_dtype),
         )
         self.register_buffer(
             "binaries",
             torch.zeros([levels] + resolution.tolist(), dtype=torch.bool),
         )
+        self.register_buffer(
+            "binaries_packed", _pack_binaries(self.binaries), persistent=False
+        )
+        # `binaries` as of the last packing, see `_get_binaries_packed()`.
+        self._binaries_packed_key: Optional[Tuple[int, int]] = None
+        # mean of `occs` kept on device, so `sampling()` doesn't need to sync.
+        self.register_buffer(
+            "_occs_mean", torch.zeros((), dtype=torch.float32), persistent=False
+        )
+        # `occs` as of the last mean, see `_get_occs_mean()`.
+        self._occs_mean_key: Optional[Tuple[int, int]] = None
+        # captured `_update()` for replay, see `update_every_n_steps()`.
+        self._update_graph: Optional[Tuple[Any, torch.cuda.CUDAGraph]] = None
+
+    def _get_binaries_packed(self) -> Tensor:
+        """`binaries_packed`, repacked if `binaries` has been assigned or
+        modified inplace since the last packing."""
+        binaries = self.binaries
+        key = _version_key(binaries)
+        if key is None or key != self._binaries_packed_key:
+            shape = (*binaries.shape[:-1], (binaries.shape[-1] + 31) // 32)
+            if (
+                self.binaries_packed.shape != shape
+                or self.binaries_packed.device != binaries.device
+            ):
+                self.binaries_packed = _pack_binaries(binaries)
+            else:
+                _pack_binaries_(binaries, self.binaries_packed)
+            self._binaries_packed_key = key
+        return self.binaries_packed
+
+    def _get_occs_mean(self) -> Tensor:
+        """`_occs_mean`, recomputed if `occs` has been assigned or modified
+        inplace since the last time it was computed."""
+        key = _version_key(self.occs)
+        if key is None or key != self._occs_mean_key:
+            self._refresh_occs_mean()
+        return self._occs_mean
+
+    def _refresh_occs_mean(self) -> None:
+        # `_C` kernels write `occs` without bumping its version, so the
+        # callers that update `occs` refresh the mean explicitly.
+        mean = self.occs.mean(dtype=torch.float32)
+        if self._occs_mean.device != mean.device:
+            self._occs_mean = mean
+        else:
+            self._occs_mean.copy_(mean)
+        self._occs_mean_key = _version_key(self.occs)
+
+    @property
+    def grid_coords(self) -> Tensor:
+        """Voxel coordinates of the cells in each level. Shape (cells_per_lvl, 3).
 
-        # Grid coords & indices
-        grid_coords = _meshgrid3d(resolution).reshape(
+        Note:
+            This is a view into a cache shared by all estimators with the same
+            resolution on the same device, so it should not be modified inplace.
+        """
+        resolution = tuple(self.binaries.shape[1:])
+        return _meshgrid3d(resolution, self.device).view(
             self.cells_per_lvl, self.DIM
         )
-        self.register_buffer("grid_coords", grid_coords, persistent=False)
-        grid_indices = torch.arange(self.cells_per_lvl)
-        self.register_buffer("grid_indices", grid_indices, persistent=False)
 
     @torch.no_grad()
     def sampling(
@@ -101,6 +175,7 @@ class OccGridEstimator(AbstractEstimator):
         alpha_thre: float = 0.0,
         stratified: bool = False,
         cone_angle: float = 0.0,
+        sort_rays: bool = False,
     ) -> Tuple[Tensor, Tensor, Tensor]:
         """Sampling with spatial skipping.
 
@@ -132,6 +207,11 @@ class OccGridEstimator(AbstractEstimator):
             stratified: Whether to use stratified sampling. Default: False.
             cone_angle: Cone angle for linearly-increased step size. 0. means
                 constant step size. Default: 0.0.
+            sort_rays: Whether to traverse the rays in the Morton order of their
+                entry points into the grid, so that neighboring threads visit
+                neighboring cells. Useful for incoherent rays (e.g., randomly
+                sampled pixels during training). The outputs are the same as
+                without sorting. Default: False.
 
         Returns:
             A tuple of {LongTensor, Tensor, Tensor}:
@@ -161,6 +241,12 @@ class OccGridEstimator(AbstractEstimator):
 
         if stratified:
             near_planes += torch.rand_like(near_planes) * render_step_size
+        if sort_rays:
+            perm = _ray_morton_order(
+                rays_o, rays_d, near_planes, self.aabbs[-1]
+            )
+            rays_o, rays_d = rays_o[perm], rays_d[perm]
+            near_planes, far_planes = near_planes[perm], far_planes[perm]
         intervals, samples, _ = traverse_grids(
             rays_o,
             rays_d,
@@ -170,22 +256,27 @@ class OccGridEstimator(AbstractEstimator):
             far_planes=far_planes,
             step_size=render_step_size,
             cone_angle=cone_angle,
+            binaries_packed=self._get_binaries_packed(),
         )
         t_starts = intervals.vals[intervals.is_left]
         t_ends = intervals.vals[intervals.is_right]
         ray_indices = samples.ray_indices
         packed_info = samples.packed_info
+        # the callbacks index the rays in the order given by the caller.
+        fn_ray_indices = perm[ray_indices] if sort_rays else ray_indices
 
         # skip invisible space
         if (alpha_thre > 0.0 or early_stop_eps > 0.0) and (
             sigma_fn is not None or alpha_fn is not None
         ):
-            alpha_thre = min(alpha_thre, self.occs.mean().item())
+            if alpha_thre > 0.0:
+                # stays on device; the mean is refreshed in `_update()`.
+                alpha_thre = torch.clamp(self._get_occs_mean(), max=alpha_thre)
 
             # Compute visibility of the samples, and filter out invisible samples
             if sigma_fn is not None:
                 if t_starts.shape[0] != 0:
-                    sigmas = sigma_fn(t_starts, t_ends, ray_indices)
+                    sigmas = sigma_fn(t_starts, t_ends, fn_ray_indices)
                 else:
                     sigmas = torch.empty((0,), device=t_starts.device)
                 assert (
@@ -201,7 +292,7 @@ class OccGridEstimator(AbstractEstimator):
                 )
             elif alpha_fn is not None:
                 if t_starts.shape[0] != 0:
-                    alphas = alpha_fn(t_starts, t_ends, ray_indices)
+                    alphas = alpha_fn(t_starts, t_ends, fn_ray_indices)
                 else:
                     alphas = torch.empty((0,), device=t_starts.device)
                 assert (
@@ -218,6 +309,10 @@ class OccGridEstimator(AbstractEstimator):
                 t_starts[masks],
                 t_ends[masks],
             )
+        if sort_rays:
+            ray_indices, t_starts, t_ends = _unpermute_samples(
+                perm, ray_indices, t_starts, t_ends
+            )
         return ray_indices, t_starts, t_ends
 
     @torch.no_grad()
@@ -229,6 +324,7 @@ class OccGridEstimator(AbstractEstimator):
         ema_decay: float = 0.95,
         warmup_steps: int = 256,
         n: int = 16,
+        cuda_graph: bool = False,
     ) -> None:
         """Update the estimator every n steps during training.
 
@@ -242,6 +338,12 @@ class OccGridEstimator(AbstractEstimator):
                 stage we change the sampling strategy to 1/4 uniformly sampled cells
                 together with 1/4 occupied cells. Default: 256.
             n: Update the grid every n steps. Default: 16.
+            cuda_graph: Whether to capture the update after the warmup stage into a
+                CUDA graph on its first call, and replay the graph afterwards. The
+                `occ_eval_fn` is captured as well, so it must be capturable (no host
+                synchronization nor dynamic shapes) and is not called again after
+                capture; only its parameters, updated inplace, are re-read on replay.
+                Default: False.
         """
         if not self.training:
             raise RuntimeError(
@@ -256,6 +358,7 @@ class OccGridEstimator(AbstractEstimator):
                 occ_thre=occ_thre,
                 ema_decay=ema_decay,
                 warmup_steps=warmup_steps,
+                cuda_graph=cuda_graph,
             )
 
     # adapted from https://github.com/kwea123/ngp_pl/blob/master/models/networks.py
@@ -290,78 +393,90 @@ class OccGridEstimator(AbstractEstimator):
         w2c_R = c2w[:, :3, :3].transpose(2, 1)  # (N_cams, 3, 3)
         w2c_T = -w2c_R @ c2w[:, :3, 3:]  # (N_cams, 3, 1)
 
-        lvl_indices = self._get_all_cells()
-        for lvl, indices in enumerate(lvl_indices):
-            grid_coords = self.grid_coords[indices]
-
-            for i in range(0, len(indices), chunk):
-                x = grid_coords[i : i + chunk] / (self.resolution - 1)
-                indices_chunk = indices[i : i + chunk]
-                # voxel coordinates [0, 1]^3 -> world
-                xyzs_w = (
-                    self.aabbs[lvl, :3]
-                    + x * (self.aabbs[lvl, 3:] - self.aabbs[lvl, :3])
-                ).T
-                xyzs_c = w2c_R @ xyzs_w + w2c_T  # (N_cams, 3, chunk)
-                uvd = K @ xyzs_c  # (N_cams, 3, chunk)
-                uv = uvd[:, :2] / uvd[:, 2:]  # (N_cams, 2, chunk)
-                in_image = (
-                    (uvd[:, 2] >= 0)
-                    & (uv[:, 0] >= 0)
-                    & (uv[:, 0] < width)
-                    & (uv[:, 1] >= 0)
-                    & (uv[:, 1] < height)
-                )
-                covered_by_cam = (
-                    uvd[:, 2] >= near_plane
-                ) & in_image  # (N_cams, chunk)
-                # if the cell is visible by at least one camera
-                count = covered_by_cam.sum(0) / N_cams
-
-                too_near_to_cam = (
-                    uvd[:, 2] < near_plane
-                ) & in_image  # (N, chunk)
-                # if the cell is too close (in front) to any camera
-                too_near_to_any_cam = too_near_to_cam.any(0)
-                # a valid cell should be visible by at least one camera and not too close to any camera
-                valid_mask = (count > 0) & (~too_near_to_any_cam)
-
-                cell_ids_base = lvl * self.cells_per_lvl
-                self.occs[cell_ids_base + indices_chunk] = torch.where(
-                    valid_mask, 0.0, -1.0
-                )
+        cell_ids = self._get_all_cells()
+        for i in range(0, len(cell_ids), chunk):
+            cell_ids_chunk = cell_ids[i : i + chunk]
+            lvls = cell_ids_chunk // self.cells_per_lvl
+            indices = cell_ids_chunk % self.cells_per_lvl
+            x = self.grid_coords[indices] / (self.resolution - 1)
+            # voxel coordinates [0, 1]^3 -> world
+            xyzs_w = torch.addcmul(
+                self.aabb_lo[lvls], x, self.aabb_scale[lvls]
+            ).T
+            xyzs_c = w2c_R @ xyzs_w + w2c_T  # (N_cams, 3, chunk)
+            uvd = K @ xyzs_c  # (N_cams, 3, chunk)
+            uv = uvd[:, :2] / uvd[:, 2:]  # (N_cams, 2, chunk)
+            in_image = (
+                (uvd[:, 2] >= 0)
+                & (uv[:, 0] >= 0)
+                & (uv[:, 0] < width)
+                & (uv[:, 1] >= 0)
+                & (uv[:, 1] < height)
+            )
+            covered_by_cam = (
+                uvd[:, 2] >= near_plane
+            ) & in_image  # (N_cams, chunk)
+            # if the cell is visible by at least one camera
+            count = covered_by_cam.sum(0) / N_cams
+
+            too_near_to_cam = (uvd[:, 2] < near_plane) & in_image  # (N, chunk)
+            # if the cell is too close (in front) to any camera
+            too_near_to_any_cam = too_near_to_cam.any(0)
+            # a valid cell should be visible by at least one camera and not too close to any camera
+            valid_mask = (count > 0) & (~too_near_to_any_cam)
+
+            self.occs[cell_ids_chunk] = torch.where(valid_mask, 0.0, -1.0).to(
+                self.occs.dtype
+            )
+        self._refresh_occs_mean()
 
     @torch.no_grad()
-    def _get_all_cells(self) -> List[Tensor]:
-        """Returns all cells of the grid."""
-        lvl_indices = []
-        for lvl in range(self.levels):
-            # filter out the cells with -1 density (non-visible to any camera)
-            cell_ids = lvl * self.cells_per_lvl + self.grid_indices
-            indices = self.grid_indices[self.occs[cell_ids] >= 0.0]
-            lvl_indices.append(indices)
-        return lvl_indices
+    def _get_all_cells(self) -> Tensor:
+        """Returns all cells of the grid, as flattened ids across levels."""
+        # filter out the cells with -1 density (non-visible to any camera)
+        return torch.nonzero(self.occs >= 0.0)[:, 0]
 
     @torch.no_grad()
-    def _sample_uniform_and_occupied_cells(self, n: int) -> List[Tensor]:
-        """Samples both n uniform and occupied cells."""
-        lvl_indices = []
-        for lvl in range(self.levels):
-            uniform_indices = torch.randint(
-                self.cells_per_lvl, (n,), device=self.device
-            )
-            # filter out the cells with -1 density (non-visible to any camera)
-            cell_ids = lvl * self.cells_per_lvl + uniform_indices
-            uniform_indices = uniform_indices[self.occs[cell_ids] >= 0.0]
-            occupied_indices = torch.nonzero(self.binaries[lvl].flatten())[:, 0]
-            if n < len(occupied_indices):
-                selector = torch.randint(
-                    len(occupied_indices), (n,), device=self.device
-                )
-                occupied_indices = occupied_indices[selector]
-            indices = torch.cat([uniform_indices, occupied_indices], dim=0)
-            lvl_indices.append(indices)
-        return lvl_indices
+    def _sample_uniform_and_occupied_cells(self, n: int) -> Tensor:
+        """Samples both n uniform and occupied cells for each level, and returns
+        them as flattened ids across levels.
+
+        The output always has the shape (levels * n * 2,), with the ids of the
+        invalid samples set to -1, so it can be computed without any host
+        synchronization.
+        """
+        lvl_bases = self.cells_per_lvl * torch.arange(
+            self.levels, device=self.device
+        )
+        uniform_ids = lvl_bases[:, None] + torch.randint(
+            self.cells_per_lvl, (self.levels, n), device=self.device
+        )
+        # filter out the cells with -1 density (non-visible to any camera)
+        uniform_ids = torch.where(
+            self.occs[uniform_ids] >= 0.0, uniform_ids, -1
+        )
+
+        # number of occupied cells up to each cell of a level.
+        cumsum = torch.cumsum(
+            self.binaries.view(self.levels, -1), dim=-1, dtype=torch.int32
+        )
+        counts = cumsum[:, -1:]
+        # take all of the occupied cells in a level if there are no more than n,
+        # otherwise randomly select n of them. The draw is done in integers as
+        # a float32 one only has 24 random bits.
+        rands = torch.randint(2**62, (self.levels, n), device=self.device)
+        selector = torch.where(
+            counts > n,
+            (rands % counts.clamp(min=1)).int(),
+            torch.arange(n, device=self.device, dtype=torch.int32),
+        )
+        # the k-th occupied cell is the first one with cumsum > k.
+        occupied_ids = lvl_bases[:, None] + torch.searchsorted(
+            cumsum, selector + 1
+        )
+        occupied_ids = torch.where(selector < counts, occupied_ids, -1)
+
+        return torch.cat([uniform_ids.flatten(), occupied_ids.flatten()])
 
     @torch.no_grad()
     def _update(
@@ -371,53 +486,186 @@ class OccGridEstimator(AbstractEstimator):
         occ_thre: float = 0.01,
         ema_decay: float = 0.95,
         warmup_steps: int = 256,
+        cuda_graph: bool = False,
     ) -> None:
         """Update the occ field in the EMA way."""
-        # sample cells
+        if cuda_graph and step >= warmup_steps:
+            self._update_with_cuda_graph(occ_eval_fn, occ_thre, ema_decay)
+            return
+
+        # sample cells from all levels
         if step < warmup_steps:
-            lvl_indices = self._get_all_cells()
+            cell_ids = self._get_all_cells()
         else:
             N = self.cells_per_lvl // 4
-            lvl_indices = self._sample_uniform_and_occupied_cells(N)
-
-        for lvl, indices in enumerate(lvl_indices):
-            # infer occupancy: density * step_size
-            grid_coords = self.grid_coords[indices]
-            x = (
-                grid_coords + torch.rand_like(grid_coords, dtype=torch.float32)
-            ) / self.resolution
-            # voxel coordinates [0, 1]^3 -> world
-            x = self.aabbs[lvl, :3] + x * (
-                self.aabbs[lvl, 3:] - self.aabbs[lvl, :3]
-            )
-            occ = occ_eval_fn(x).squeeze(-1)
-            # ema update
-            cell_ids = lvl * self.cells_per_lvl + indices
-            self.occs[cell_ids] = torch.maximum(
-                self.occs[cell_ids] * ema_decay, occ
-            )
-            # suppose to use scatter max but emperically it is almost the same.
-            # self.occs, _ = scatter_max(
-            #     occ, indices, dim=0, out=self.occs * ema_decay
-            # )
-        thre = torch.clamp(self.occs[self.occs >= 0].mean(), max=occ_thre)
-        self.binaries = (self.occs > thre).view(self.binaries.shape)
+            cell_ids = self._sample_uniform_and_occupied_cells(N)
+            cell_ids = cell_ids[cell_ids >= 0]
+        self._update_cells(cell_ids, occ_eval_fn, occ_thre, ema_decay)
+
+    @torch.no_grad()
+    def _update_cells(
+        self,
+        cell_ids: Tensor,
+        occ_eval_fn: Callable,
+        occ_thre: float,
+        ema_decay: float,
+    ) -> None:
+        """Update the given cells (-1 for padding) and then the binaries.
 
+        This function is free of host synchronization, so that it can be
+        captured by CUDA graphs.
+        """
+        # infer occupancy for all levels at once: density * step_size
+        x = _grid_cell_positions(
+            cell_ids.clamp(min=0), self.aabbs, self.binaries.shape[1:]
+        )
+        occ = occ_eval_fn(x).squeeze(-1)
+        # ema update, as a scatter max over the duplicated cells.
+        _grid_ema_update_(self.occs, cell_ids, occ, ema_decay)
+        # the threshold is computed in fp32 and compared in the dtype of occs.
+        valid = self.occs >= 0
+        mean = torch.where(valid, self.occs, 0).sum(dtype=torch.float32)
+        mean = mean / valid.sum()
+        thre = torch.clamp(mean, max=occ_thre).to(self.occs.dtype)
+        self._refresh_occs_mean()
+        # write inplace to keep the buffers (and their memory) across updates.
+        torch.gt(self.occs, thre, out=self.binaries.view(-1))
+        self._get_binaries_packed()
 
+    @torch.no_grad()
+    def _update_with_cuda_graph(
+        self, occ_eval_fn: Callable, occ_thre: float, ema_decay: float
+    ) -> None:
+        """The post-warmup `_update()`, captured on the first call and replayed."""
+        N = self.cells_per_lvl // 4
+        # the graph reads and writes the buffers by their memory addresses.
+        key = (
+            occ_thre,
+            ema_decay,
+            self.occs.data_ptr(),
+            self.binaries.data_ptr(),
+            self.binaries_packed.data_ptr(),
+        )
+        if self._update_graph is not None and self._update_graph[0] == key:
+            self._update_graph[1].replay()
+            return
+
+        # warmup on a side stream before capturing, which also performs this
+        # update for real.
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream):
+            cell_ids = self._sample_uniform_and_occupied_cells(N)
+            self._update_cells(cell_ids, occ_eval_fn, occ_thre, ema_decay)
+        torch.cuda.current_stream().wait_stream(stream)
+
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph):
+            cell_ids = self._sample_uniform_and_occupied_cells(N)
+            self._update_cells(cell_ids, occ_eval_fn, occ_thre, ema_decay)
+        self._update_graph = (key, graph)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # also called when loading the state dict of a parent module.
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+        # the non-persistent buffers are not saved so we rebuild them.
+        with torch.no_grad():
+            self._binaries_packed_key = None
+            self._get_binaries_packed()
+            self.aabb_lo.copy_(self.aabbs[:, :3])
+            self.aabb_scale.copy_(self.aabbs[:, 3:] - self.aabbs[:, :3])
+            self._refresh_occs_mean()
+
+
+def _version_key(x: Tensor) -> Optional[Tuple[int, int]]:
+    """Identifies `x` and its inplace modifications, or None if unknown."""
+    if torch.is_inference(x):  # no version counter
+        return None
+    return (x._version, x.data_ptr())
+
+
+@functools.lru_cache(maxsize=8)
 def _meshgrid3d(
-    res: Tensor, device: Union[torch.device, str] = "cpu"
+    res: Tuple[int, int, int],
+    device: Union[torch.device, str] = "cpu",
+    dtype: torch.dtype = torch.int16,
 ) -> Tensor:
-    """Create 3D grid coordinates."""
+    """Create 3D grid coordinates.
+
+    The results are cached, so the returned tensor is shared across callers.
+    """
     assert len(res) == 3
-    res = res.tolist()
+    assert max(res) <= torch.iinfo(dtype).max, f"Resolution too large: {res}!"
     return torch.stack(
         torch.meshgrid(
             [
-                torch.arange(res[0], dtype=torch.long),
-                torch.arange(res[1], dtype=torch.long),
-                torch.arange(res[2], dtype=torch.long),
+                torch.arange(res[0], dtype=dtype, device=device),
+                torch.arange(res[1], dtype=dtype, device=device),
+                torch.arange(res[2], dtype=dtype, device=device),
             ],
             indexing="ij",
         ),
         dim=-1,
-    ).to(device)
+    )
+
+
+def _morton3d(ijk: Tensor) -> Tensor:
+    """Interleave the bits of (..., 3) integer coordinates in [0, 1024)."""
+    codes = []
+    for i in range(3):
+        x = ijk[..., i].long() & 0x3FF
+        x = (x | (x << 16)) & 0x030000FF
+        x = (x | (x << 8)) & 0x0300F00F
+        x = (x | (x << 4)) & 0x030C30C3
+        x = (x | (x << 2)) & 0x09249249
+        codes.append(x << i)
+    return codes[0] | codes[1] | codes[2]
+
+
+def _ray_morton_order(
+    rays_o: Tensor,  # [n_rays, 3]
+    rays_d: Tensor,  # [n_rays, 3]
+    near_planes: Tensor,  # [n_rays]
+    aabb: Tensor,  # [6]
+) -> Tensor:
+    """Permutation that sorts the rays by the Morton code of their entry points
+    into the `aabb`, quantized to a 1024^3 grid."""
+    t_mins, _, hits = ray_aabb_intersect(rays_o, rays_d, aabb[None])
+    t_entry = torch.where(
+        hits[:, 0], torch.maximum(t_mins[:, 0], near_planes), near_planes
+    )
+    x = rays_o + t_entry[:, None] * rays_d
+    x = (x - aabb[:3]) / (aabb[3:] - aabb[:3])
+    ijk = (x.clamp(0.0, 1.0) * 1023).long()
+    return torch.argsort(_morton3d(ijk))
+
+
+def _unpermute_samples(
+    perm: Tensor,  # [n_rays]
+    ray_indices: Tensor,  # [n_samples]
+    t_starts: Tensor,  # [n_samples]
+    t_ends: Tensor,  # [n_samples]
+) -> Tuple[Tensor, Tensor, Tensor]:
+    """Map the samples of the permuted rays `rays[perm]` back to the original
+    ray order, keeping the samples of each ray contiguous and ordered."""
+    n_rays, n_samples = perm.shape[0], ray_indices.shape[0]
+    if n_samples == 0:
+        return ray_indices, t_starts, t_ends
+    chunk_starts, chunk_cnts = pack_info(ray_indices, n_rays).unbind(-1)
+    # chunks in the original ray order.
+    src_starts = torch.empty_like(chunk_starts)
+    src_starts[perm] = chunk_starts
+    cnts = torch.empty_like(chunk_cnts)
+    cnts[perm] = chunk_cnts
+    starts = torch.cumsum(cnts, dim=0) - cnts
+    ray_indices = torch.repeat_interleave(
+        torch.arange(n_rays, device=perm.device, dtype=ray_indices.dtype),
+        cnts,
+        output_size=n_samples,
+    )
+    src = (
+        torch.arange(n_samples, device=perm.device)
+        - starts[ray_indices]
+        + src_starts[ray_indices]
+    )
+    return ray_indices, t_starts[src], t_ends[src]
@@ -1,4 +1,4 @@
-from typing import Callable, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
 try:
     from typing import Literal
@@ -9,7 +9,7 @@ import torch
 from torch import Tensor
 
 from ..data_specs import RayIntervals
-from ..pdf import importance_sampling, searchsorted
+from ..pdf import _density_to_cdf, importance_sampling, searchsorted
 from ..volrend import render_transmittance_from_density
 from .base import AbstractEstimator
 
@@ -33,6 +33,8 @@ class PropNetEstimator(AbstractEstimator):
         self.optimizer = optimizer
         self.scheduler = scheduler
         self.prop_cache: List = []
+        # per-level scratch buffers of `importance_sampling` in `sampling()`.
+        self._sampling_buffers: Dict[int, Tuple[Tensor, Tensor]] = {}
 
     @torch.no_grad()
     def sampling(
@@ -92,10 +94,25 @@ class PropNetEstimator(AbstractEstimator):
             dim=-1,
         )
         intervals = RayIntervals(vals=cdfs)
+        if not requires_grad:
+            # The cdfs are not cached so we can reuse one buffer for all levels.
+            cdfs_buffer = torch.empty(
+                (n_rays * (max(prop_samples, default=0) + 1),),
+                device=self.device,
+            )
 
-        for level_fn, level_samples in zip(prop_sigma_fns, prop_samples):
+        for level, (level_fn, level_samples) in enumerate(
+            zip(prop_sigma_fns, prop_samples)
+        ):
+            # The intervals are cached for the loss if `requires_grad`, so
+            # they can only be written into the reused buffers otherwise.
+            out = (
+                None
+                if requires_grad
+                else self._get_sampling_buffers(level, n_rays, level_samples)
+            )
             intervals, _ = importance_sampling(
-                intervals, cdfs, level_samples, stratified
+                intervals, cdfs, level_samples, stratified, out=out
             )
             t_vals = _transform_stot(
                 sampling_type, intervals.vals, near_plane, far_plane
@@ -105,15 +122,21 @@ class PropNetEstimator(AbstractEstimator):
 
             with torch.set_grad_enabled(requires_grad):
                 sigmas = level_fn(t_starts, t_ends)
-                assert sigmas.shape == t_starts.shape
-                trans, _ = render_transmittance_from_density(
-                    t_starts, t_ends, sigmas
-                )
-                cdfs = 1.0 - torch.cat(
-                    [trans, torch.zeros_like(trans[:, :1])], dim=-1
-                )
                 if requires_grad:
+                    assert sigmas.shape == t_starts.shape
+                    trans, _ = render_transmittance_from_density(
+                        t_starts, t_ends, sigmas
+                    )
+                    cdfs = 1.0 - torch.cat(
+                        [trans, torch.zeros_like(trans[:, :1])], dim=-1
+                    )
                     self.prop_cache.append((intervals, cdfs))
+                else:
+                    cdfs = cdfs_buffer[: n_rays * (level_samples + 1)]
+                    cdfs = cdfs.view(n_rays, level_samples + 1)
+                    # transmittance -> cdfs in one fused kernel, which also
+                    # checks the shape of the sigmas.
+                    _density_to_cdf(t_starts, t_ends, sigmas, out=cdfs)
 
         intervals, _ = importance_sampling(
             intervals, cdfs, num_samples, stratified
@@ -128,6 +151,24 @@ class PropNetEstimator(AbstractEstimator):
 
         return t_starts, t_ends
 
+    def _get_sampling_buffers(
+        self, level: int, n_rays: int, n_samples: int
+    ) -> Tuple[Tensor, Tensor]:
+        """Buffers to hold {intervals, samples} of a proposal level, which are
+        reused across calls with the same shape."""
+        buffers = self._sampling_buffers.get(level)
+        if (
+            buffers is None
+            or buffers[1].shape != (n_rays, n_samples)
+            or buffers[1].device != self.device
+        ):
+            buffers = (
+                torch.empty((n_rays, n_samples + 1), device=self.device),
+                torch.empty((n_rays, n_samples), device=self.device),
+            )
+            self._sampling_buffers[level] = buffers
+        return buffers
+
     @torch.enable_grad()
     def compute_loss(self, trans: Tensor, loss_scaler: float = 1.0) -> Tensor:
         """Compute the loss for the proposal networks.
@@ -215,18 +256,27 @@ def get_proposal_requires_grad_fn(
 def _transform_stot(
     transform_type: Literal["uniform", "lindisp"],
     s_vals: torch.Tensor,
-    t_min: torch.Tensor,
-    t_max: torch.Tensor,
+    t_min: float,
+    t_max: float,
 ) -> torch.Tensor:
     if transform_type == "uniform":
-        _contract_fn, _icontract_fn = lambda x: x, lambda x: x
+        return _transform_stot_fused(s_vals, t_min, t_max, False)
     elif transform_type == "lindisp":
-        _contract_fn, _icontract_fn = lambda x: 1 / x, lambda x: 1 / x
+        return _transform_stot_fused(s_vals, 1 / t_min, 1 / t_max, True)
     else:
         raise ValueError(f"Unknown transform_type: {transform_type}")
-    s_min, s_max = _contract_fn(t_min), _contract_fn(t_max)
-    icontract_fn = lambda s: _icontract_fn(s * s_max + (1 - s) * s_min)
-    return icontract_fn(s_vals)
+
+
+@torch.jit.script
+def _transform_stot_fused(
+    s_vals: torch.Tensor, s_min: float, s_max: float, inverse: bool
+) -> torch.Tensor:
+    """Pointwise `icontract(s * s_max + (1 - s) * s_min)` that TorchScript fuses
+    into a single kernel."""
+    t_vals = s_vals * s_max + (1.0 - s_vals) * s_min
+    if inverse:
+        t_vals = 1.0 / t_vals
+    return t_vals
 
 
 def _pdf_loss(
@@ -238,22 +288,43 @@ def _pdf_loss(
 ) -> torch.Tensor:
     ids_left, ids_right = searchsorted(segments_key, segments_query)
     if segments_query.vals.dim() > 1:
-        w = cdfs_query[..., 1:] - cdfs_query[..., :-1]
+        cdfs_query_left = cdfs_query[..., :-1]
+        cdfs_query_right = cdfs_query[..., 1:]
         ids_left = ids_left[..., :-1]
         ids_right = ids_right[..., 1:]
     else:
-        # TODO: not tested for this branch.
         assert segments_query.is_left is not None
-        assert segments_query.is_right is not None
-        w = (
-            cdfs_query[segments_query.is_right]
-            - cdfs_query[segments_query.is_left]
-        )
-        ids_left = ids_left[segments_query.is_left]
-        ids_right = ids_right[segments_query.is_right]
+        # The right edge of an interval always directly follows its left edge,
+        # so a single index tensor addresses both sides of all intervals.
+        lefts = torch.nonzero(segments_query.is_left)[:, 0]
+        rights = lefts + 1
+        cdfs_query_left = cdfs_query[lefts]
+        cdfs_query_right = cdfs_query[rights]
+        ids_left = ids_left[lefts]
+        ids_right = ids_right[rights]
+
+    return _pdf_loss_fused(
+        cdfs_query_left,
+        cdfs_query_right,
+        cdfs_key.gather(-1, ids_left),
+        cdfs_key.gather(-1, ids_right),
+        eps,
+    )
 
-    w_outer = cdfs_key.gather(-1, ids_right) - cdfs_key.gather(-1, ids_left)
-    return torch.clip(w - w_outer, min=0) ** 2 / (w + eps)
+
+@torch.jit.script
+def _pdf_loss_fused(
+    cdfs_query_left: torch.Tensor,
+    cdfs_query_right: torch.Tensor,
+    cdfs_key_left: torch.Tensor,
+    cdfs_key_right: torch.Tensor,
+    eps: float,
+) -> torch.Tensor:
+    """Pointwise part of `_pdf_loss()` that TorchScript fuses into a single
+    kernel (and a single one for the backward)."""
+    w = cdfs_query_right - cdfs_query_left
+    w_outer = cdfs_key_right - cdfs_key_left
+    return torch.clip(w - w_outer, min=0.0) ** 2 / (w + eps)
 
 
 def _outer(
@@ -1,9 +1,10 @@
 """
 Copyright (c) 2022 Ruilong Li, UC Berkeley.
 """
-from typing import Optional, Tuple
+from typing import Optional, Sequence, Tuple
 
 import torch
+import torch.nn.functional as F
 from torch import Tensor
 
 from . import cuda as _C
@@ -110,6 +111,8 @@ def traverse_grids(
     t_sorted: Optional[Tensor] = None,  # [n_rays, n_grids * 2]
     t_indices: Optional[Tensor] = None,  # [n_rays, n_grids * 2]
     hits: Optional[Tensor] = None,  # [n_rays, n_grids]
+    # pre-packed grids
+    binaries_packed: Optional[Tensor] = None,  # [m, resx, resy, ceil(resz/32)]
 ) -> Tuple[RayIntervals, RaySamples, Tensor]:
     """Ray Traversal within Multiple Grids.
 
@@ -132,6 +135,9 @@ def traverse_grids(
         t_sorted: Optional. (n_rays, n_grids * 2) Pre-computed sorted t values for each ray-grid pair. Default to None.
         t_indices: Optional. (n_rays, n_grids * 2) Pre-computed sorted t indices for each ray-grid pair. Default to None.
         hits: Optional. (n_rays, n_grids) Pre-computed hit flags for each ray-grid pair. Default to None.
+        binaries_packed: Optional. (m, resx, resy, ceil(resz / 32)) Pre-computed `binaries` that are
+            bit-packed along z into int32 words (see `_pack_binaries()`). If not given, `binaries` will
+            be packed on the fly. Default to None.
 
     Returns:
         A :class:`RayIntervals` object containing the intervals of the ray traversal, and
@@ -153,6 +159,9 @@ def traverse_grids(
             traverse_steps_limit > 0
         ), "traverse_steps_limit must be set if over_allocate is True."
 
+    if binaries_packed is None:
+        binaries_packed = _pack_binaries(binaries)
+
     if t_sorted is None or t_indices is None or hits is None:
         # Compute ray aabb intersection for all levels of grid. [n_rays, m]
         t_mins, t_maxs, hits = ray_aabb_intersect(rays_o, rays_d, aabbs)
@@ -168,7 +177,8 @@ def traverse_grids(
         rays_d.contiguous(),  # [n_rays, 3]
         rays_mask.contiguous(),  # [n_rays]
         # grids
-        binaries.contiguous(),  # [m, resx, resy, resz]
+        binaries_packed.contiguous(),  # [m, resx, resy, ceil(resz / 32)]
+        binaries.shape[-1],  # resz
         aabbs.contiguous(),  # [m, 6]
         # intersections
         t_sorted.contiguous(),  # [n_rays, m * 2]
@@ -192,6 +202,112 @@ def traverse_grids(
     )
 
 
+@torch.no_grad()
+def _pack_binaries(binaries: Tensor) -> Tensor:
+    """Bit-pack the binary grids along z into int32 words.
+
+    Voxel (x, y, z) of the i-th grid is stored in the (z % 32)-th bit of
+    `binaries_packed[i, x, y, z // 32]`.
+
+    Args:
+        binaries: (m, resx, resy, resz) Binary grids.
+
+    Returns:
+        (m, resx, resy, ceil(resz / 32)) Bit-packed binary grids.
+    """
+    resz = binaries.shape[-1]
+    n_words = (resz + 31) // 32
+    if binaries.is_cuda:
+        binaries_packed = torch.empty(
+            (*binaries.shape[:-1], n_words),
+            dtype=torch.int32,
+            device=binaries.device,
+        )
+        _C.pack_binaries(binaries.contiguous(), binaries_packed)
+        return binaries_packed
+
+    bits = F.pad(binaries.long(), (0, n_words * 32 - resz))
+    bits = bits.view(*binaries.shape[:-1], n_words, 32)
+    shifts = torch.arange(32, device=binaries.device)
+    words = (bits << shifts).sum(dim=-1)
+    # reinterpret the unsigned 32-bit words as int32.
+    words = torch.where(words >= 2**31, words - 2**32, words)
+    return words.int()
+
+
+@torch.no_grad()
+def _pack_binaries_(binaries: Tensor, binaries_packed: Tensor) -> None:
+    """Inplace version of `_pack_binaries()` that writes into `binaries_packed`."""
+    if binaries.is_cuda:
+        _C.pack_binaries(binaries.contiguous(), binaries_packed)
+    else:
+        binaries_packed.copy_(_pack_binaries(binaries))
+
+
+@torch.no_grad()
+def _grid_cell_positions(
+    cell_ids: Tensor,  # [n_cells]
+    aabbs: Tensor,  # [m, 6]
+    resolution: Sequence[int],  # [3]
+) -> Tensor:
+    """Jittered world-space positions of the grid cells.
+
+    Args:
+        cell_ids: (n_cells,) Flattened cell ids across all grids, i.e.,
+            `level * resx * resy * resz + index`.
+        aabbs: (m, 6) Axis-aligned bounding boxes of the grids.
+        resolution: The resolution {resx, resy, resz} shared by all grids.
+
+    Returns:
+        (n_cells, 3) A random position within each cell.
+    """
+    if cell_ids.is_cuda:
+        return _C.grid_cell_positions(
+            cell_ids.contiguous(), aabbs.contiguous(), list(resolution)
+        )
+
+    resx, resy, resz = resolution
+    levels = cell_ids // (resx * resy * resz)
+    indices = cell_ids % (resx * resy * resz)
+    coords = torch.stack(
+        [indices // (resy * resz), (indices // resz) % resy, indices % resz],
+        dim=-1,
+    )
+    res = torch.tensor(resolution, dtype=torch.float32, device=aabbs.device)
+    x = (coords + torch.rand_like(coords, dtype=torch.float32)) / res
+    aabbs = aabbs[levels]
+    return aabbs[:, :3] + x * (aabbs[:, 3:] - aabbs[:, :3])
+
+
+@torch.no_grad()
+def _grid_ema_update_(
+    occs: Tensor,  # [m * resx * resy * resz]
+    cell_ids: Tensor,  # [n_cells]
+    occ: Tensor,  # [n_cells]
+    ema_decay: float,
+) -> None:
+    """Inplace EMA update: `occs[cell_ids] = max(occs[cell_ids] * ema_decay, occ)`.
+
+    The update is computed in fp32 and stored in the dtype of `occs`, which
+    can be float32, float16 or bfloat16. Negative cell ids are skipped. A cell
+    that appears multiple times is decayed once and takes the max of all its
+    `occ` values, i.e., a scatter max.
+    """
+    assert occs.is_contiguous(), "occs must be contiguous."
+    if occs.is_cuda:
+        _C.grid_ema_update(
+            occs, cell_ids.contiguous(), occ.float().contiguous(), ema_decay
+        )
+        return
+
+    valid = cell_ids >= 0
+    cell_ids, occ = cell_ids[valid], occ[valid]
+    unique_ids = torch.unique(cell_ids)
+    occs[unique_ids] = (occs[unique_ids].float() * ema_decay).to(occs.dtype)
+    # rounding to the dtype of `occs` keeps the order, so the max is exact.
+    occs.scatter_reduce_(0, cell_ids, occ.to(occs.dtype), "amax")
+
+
 def _enlarge_aabb(aabb, factor: float) -> Tensor:
     center = (aabb[:3] + aabb[3:]) / 2
     extent = (aabb[3:] - aabb[:3]) / 2
@@ -1,7 +1,7 @@
 """
 Copyright (c) 2022 Ruilong Li, UC Berkeley.
 """
-from typing import Tuple, Union
+from typing import Optional, Tuple, Union
 
 import torch
 from torch import Tensor
@@ -67,6 +67,7 @@ def importance_sampling(
     cdfs: Tensor,
     n_intervals_per_ray: Union[Tensor, int],
     stratified: bool = False,
+    out: Optional[Tuple[Tensor, Tensor]] = None,
 ) -> Tuple[RayIntervals, RaySamples]:
     """Importance sampling that supports flattened tensor.
 
@@ -83,6 +84,10 @@ def importance_sampling(
             If it is a tensor, it must be of shape (n_rays,). If it is an int,
             it is broadcasted to all rays.
         stratified: If True, perform stratified sampling.
+        out: Optional. Preallocated tensors {`intervals.vals`, `samples.vals`} to
+            write the results into, with shapes (n_rays, n_intervals_per_ray + 1)
+            and (n_rays, n_intervals_per_ray). Only supported when
+            `n_intervals_per_ray` is an int.
 
     Returns:
         A tuple of {:class:`RayIntervals`, :class:`RaySamples`}:
@@ -121,16 +126,51 @@ def importance_sampling(
 
     """
     if isinstance(n_intervals_per_ray, Tensor):
+        assert out is None, "`out` requires an int `n_intervals_per_ray`."
         n_intervals_per_ray = n_intervals_per_ray.contiguous()
     intervals, samples = _C.importance_sampling(
         intervals._to_cpp(),
         cdfs.contiguous(),
         n_intervals_per_ray,
         stratified,
+        *(out if out is not None else ()),
     )
     return RayIntervals._from_cpp(intervals), RaySamples._from_cpp(samples)
 
 
+@torch.no_grad()
+def _density_to_cdf(
+    t_starts: Tensor,  # [n_rays, n_samples]
+    t_ends: Tensor,  # [n_rays, n_samples]
+    sigmas: Tensor,  # [n_rays, n_samples]
+    out: Optional[Tensor] = None,  # [n_rays, n_samples + 1]
+) -> Tensor:
+    """Fused `1 - cat([render_transmittance_from_density(...)[0], 0])`.
+
+    The CDFs at the interval edges are computed in one kernel without
+    materializing the transmittance. No gradients are supported.
+
+    Returns:
+        (n_rays, n_samples + 1) The CDFs, written into `out` if given.
+    """
+    # the kernel reads fp32 rows with any row stride, so the sliced
+    # `t_vals[..., :-1]` and `t_vals[..., 1:]` are used without a copy.
+    def _prepare(x: Tensor) -> Tensor:
+        x = x.float()
+        return x if x.stride(-1) == 1 else x.contiguous()
+
+    if out is None:
+        out = torch.empty(
+            (sigmas.shape[0], sigmas.shape[1] + 1),
+            dtype=torch.float32,
+            device=sigmas.device,
+        )
+    _C.density_to_cdf(
+        _prepare(t_starts), _prepare(t_ends), _prepare(sigmas), out
+    )
+    return out
+
+
 def _sample_from_weighted(
     bins: Tensor,
     weights: Tensor,
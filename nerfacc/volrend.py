@@ -2,7 +2,7 @@
 Copyright (c) 2022 Ruilong Li, UC Berkeley.
 """
 
-from typing import Callable, Dict, Optional, Tuple
+from typing import Callable, Dict, Optional, Tuple, Union
 
 import torch
 from torch import Tensor
@@ -383,7 +383,7 @@ def render_visibility_from_alpha(
     ray_indices: Optional[Tensor] = None,
     n_rays: Optional[int] = None,
     early_stop_eps: float = 1e-4,
-    alpha_thre: float = 0.0,
+    alpha_thre: Union[float, Tensor] = 0.0,
     prefix_trans: Optional[Tensor] = None,
 ) -> Tensor:
     """Compute visibility from opacity :math:`\\alpha_i`.
@@ -404,7 +404,8 @@ def render_visibility_from_alpha(
         ray_indices: Ray indices of the flattened samples. LongTensor with shape (all_samples).
         n_rays: Number of rays. Only useful when `ray_indices` is provided.
         early_stop_eps: The early stopping threshold on transmittance.
-        alpha_thre: The threshold on opacity.
+        alpha_thre: The threshold on opacity. Can also be a 0-dim tensor, which
+            is always applied to avoid a device-to-host sync.
         prefix_trans: The pre-computed transmittance of the samples. Tensor with shape (all_samples,).
 
     Returns:
@@ -427,7 +428,7 @@ def render_visibility_from_alpha(
         alphas, packed_info, ray_indices, n_rays, prefix_trans
     )
     vis = trans >= early_stop_eps
-    if alpha_thre > 0:
+    if isinstance(alpha_thre, Tensor) or alpha_thre > 0:
         vis = vis & (alphas >= alpha_thre)
     return vis
 
@@ -441,7 +442,7 @@ def render_visibility_from_density(
     ray_indices: Optional[Tensor] = None,
     n_rays: Optional[int] = None,
     early_stop_eps: float = 1e-4,
-    alpha_thre: float = 0.0,
+    alpha_thre: Union[float, Tensor] = 0.0,
     prefix_trans: Optional[Tensor] = None,
 ) -> Tensor:
     """Compute visibility from density :math:`\\sigma_i` and interval :math:`\\delta_i`.
@@ -462,7 +463,8 @@ def render_visibility_from_density(
         ray_indices: Ray indices of the flattened samples. LongTensor with shape (all_samples).
         n_rays: Number of rays. Only useful when `ray_indices` is provided.
         early_stop_eps: The early stopping threshold on transmittance.
-        alpha_thre: The threshold on opacity.
+        alpha_thre: The threshold on opacity. Can also be a 0-dim tensor, which
+            is always applied to avoid a device-to-host sync.
         prefix_trans: The pre-computed transmittance of the samples. Tensor with shape (all_samples,).
 
     Returns:
@@ -489,7 +491,7 @@ def render_visibility_from_density(
         t_starts, t_ends, sigmas, packed_info, ray_indices, n_rays, prefix_trans
     )
     vis = trans >= early_stop_eps
-    if alpha_thre > 0:
+    if isinstance(alpha_thre, Tensor) or alpha_thre > 0:
         vis = vis & (alphas >= alpha_thre)
     return vis
 
@@ -68,6 +68,40 @@ def test_traverse_grids():
     assert selector.all(), selector.float().mean()
 
 
+@pytest.mark.skipif(not torch.cuda.is_available, reason="No CUDA device")
+def test_pack_binaries():
+    from nerfacc.grid import _pack_binaries, _pack_binaries_
+
+    torch.manual_seed(42)
+    binaries = torch.rand((4, 32, 16, 40), device=device) > 0.5
+    binaries_packed = _pack_binaries(binaries)
+    assert binaries_packed.shape == (4, 32, 16, 2)
+
+    z = torch.arange(40, device=device)
+    words = binaries_packed[..., z // 32].long() & 0xFFFFFFFF
+    _binaries = ((words >> (z % 32)) & 1).bool()
+    assert (binaries == _binaries).all()
+
+    # inplace packing
+    _binaries_packed = torch.zeros_like(binaries_packed)
+    _pack_binaries_(binaries, _binaries_packed)
+    assert (binaries_packed == _binaries_packed).all()
+
+    # the estimator repacks after `binaries` is assigned or edited inplace.
+    from nerfacc import OccGridEstimator
+
+    estimator = OccGridEstimator(
+        roi_aabb=[-1.0, -1.0, -1.0, 1.0, 1.0, 1.0], resolution=32, levels=2
+    ).to(device)
+    binaries = torch.rand((2, 32, 32, 32), device=device) > 0.5
+    estimator.binaries = binaries
+    packed = estimator._get_binaries_packed()
+    assert (packed == _pack_binaries(binaries)).all()
+    estimator.binaries[0].logical_not_()
+    packed = estimator._get_binaries_packed()
+    assert (packed == _pack_binaries(estimator.binaries)).all()
+
+
 @pytest.mark.skipif(not torch.cuda.is_available, reason="No CUDA device")
 def test_traverse_grids_test_mode():
     from nerfacc.grid import _enlarge_aabb, traverse_grids
@@ -203,6 +237,60 @@ def test_sampling_with_min_max_distances():
     assert (t_ends <= (t_max[ray_indices] + render_step_size / 2)).all()
 
 
+@pytest.mark.skipif(not torch.cuda.is_available, reason="No CUDA device")
+def test_sampling_with_sorted_rays():
+    from nerfacc import OccGridEstimator
+
+    torch.manual_seed(42)
+    n_rays = 1024
+    levels = 4
+    resolution = 32
+
+    rays_o = torch.rand((n_rays, 3), device=device) * 2 - 1.0
+    rays_d = torch.randn((n_rays, 3), device=device)
+    rays_d = rays_d / rays_d.norm(dim=-1, keepdim=True)
+
+    aabb = torch.tensor([-1.0, -1.0, -1.0, 1.0, 1.0, 1.0], device=device)
+    binaries = (
+        torch.rand((levels, resolution, resolution, resolution), device=device)
+        > 0.5
+    )
+    grid_estimator = OccGridEstimator(
+        roi_aabb=aabb, resolution=resolution, levels=levels
+    )
+    grid_estimator.binaries = binaries
+
+    ray_indices, t_starts, t_ends = grid_estimator.sampling(
+        rays_o=rays_o, rays_d=rays_d, render_step_size=0.01
+    )
+    _ray_indices, _t_starts, _t_ends = grid_estimator.sampling(
+        rays_o=rays_o, rays_d=rays_d, render_step_size=0.01, sort_rays=True
+    )
+    assert torch.equal(ray_indices, _ray_indices)
+    assert torch.allclose(t_starts, _t_starts)
+    assert torch.allclose(t_ends, _t_ends)
+
+    # the callbacks see the ray indices of the unsorted rays.
+    def sigma_fn(t_starts, t_ends, ray_indices):
+        t_mid = (t_starts + t_ends)[:, None] / 2.0
+        x = rays_o[ray_indices] + t_mid * rays_d[ray_indices]
+        return (x.norm(dim=-1) < 0.5).float() * 100.0
+
+    ray_indices, t_starts, t_ends = grid_estimator.sampling(
+        rays_o=rays_o, rays_d=rays_d, render_step_size=0.01, sigma_fn=sigma_fn
+    )
+    _ray_indices, _t_starts, _t_ends = grid_estimator.sampling(
+        rays_o=rays_o,
+        rays_d=rays_d,
+        render_step_size=0.01,
+        sigma_fn=sigma_fn,
+        sort_rays=True,
+    )
+    assert torch.equal(ray_indices, _ray_indices)
+    assert torch.allclose(t_starts, _t_starts)
+    assert torch.allclose(t_ends, _t_ends)
+
+
 @pytest.mark.skipif(not torch.cuda.is_available, reason="No CUDA device")
 def test_mark_invisible_cells():
     from nerfacc import OccGridEstimator
@@ -233,10 +321,188 @@ def test_mark_invisible_cells():
     assert (grid_estimator.occs == 0).sum() == 53412
 
 
+@pytest.mark.skipif(not torch.cuda.is_available, reason="No CUDA device")
+def test_grid_ema_update():
+    from nerfacc.grid import (
+        _enlarge_aabb,
+        _grid_cell_positions,
+        _grid_ema_update_,
+    )
+
+    torch.manual_seed(42)
+    levels = 4
+    resolution = (32, 16, 8)
+    cells_per_lvl = 32 * 16 * 8
+
+    base_aabb = torch.tensor([-1.0, -1.0, -1.0, 1.0, 1.0, 1.0], device=device)
+    aabbs = torch.stack(
+        [_enlarge_aabb(base_aabb, 2**i) for i in range(levels)]
+    )
+    cell_ids = torch.randperm(levels * cells_per_lvl, device=device)[:1000]
+
+    # the jittered positions should fall into their own cells.
+    x = _grid_cell_positions(cell_ids, aabbs, resolution)
+    levels_ids = cell_ids // cells_per_lvl
+    aabbs_min, aabbs_max = aabbs[levels_ids, :3], aabbs[levels_ids, 3:]
+    res = torch.tensor(resolution, device=device)
+    coords = ((x - aabbs_min) / (aabbs_max - aabbs_min) * res).long()
+    coords = torch.minimum(coords, res - 1)
+    _cell_ids = (
+        levels_ids * cells_per_lvl
+        + coords[:, 0] * resolution[1] * resolution[2]
+        + coords[:, 1] * resolution[2]
+        + coords[:, 2]
+    )
+    assert (cell_ids == _cell_ids).all()
+
+    # ema update
+    occs = torch.rand((levels * cells_per_lvl,), device=device)
+    occ = torch.rand((cell_ids.shape[0],), device=device)
+    _occs = occs.clone()
+    _occs[cell_ids] = torch.maximum(_occs[cell_ids] * 0.95, occ)
+    _grid_ema_update_(occs, cell_ids, occ, 0.95)
+    assert torch.allclose(occs, _occs)
+
+    # ema update with occs stored in half precision
+    occs = occs.to(torch.bfloat16)
+    _occs = occs.float()
+    _occs[cell_ids] = torch.maximum(_occs[cell_ids] * 0.95, occ)
+    _grid_ema_update_(occs, cell_ids, occ, 0.95)
+    assert occs.dtype == torch.bfloat16
+    assert torch.allclose(occs, _occs.to(torch.bfloat16))
+
+    # ema update with duplicated cells: each cell is decayed once and then
+    # takes the max over all of its new values.
+    cell_ids = torch.randint(0, 64, (1000,), device=device)
+    occ = torch.rand((cell_ids.shape[0],), device=device)
+    for dtype in [torch.float32, torch.float16, torch.bfloat16]:
+        occs = torch.rand((levels * cells_per_lvl,), device=device)
+        occs = occs.to(dtype)
+        _occs = occs.float()
+        _occs[cell_ids] = _occs[cell_ids] * 0.95
+        _occs.scatter_reduce_(0, cell_ids, occ, reduce="amax")
+        _grid_ema_update_(occs, cell_ids, occ, 0.95)
+        assert torch.allclose(occs, _occs.to(dtype))
+
+
+@pytest.mark.skipif(not torch.cuda.is_available, reason="No CUDA device")
+def test_update_with_cuda_graph():
+    from nerfacc import OccGridEstimator
+    from nerfacc.grid import _pack_binaries
+
+    torch.manual_seed(42)
+    estimator = OccGridEstimator(
+        roi_aabb=[-1.0, -1.0, -1.0, 1.0, 1.0, 1.0], resolution=32, levels=2
+    ).to(device)
+
+    def occ_eval_fn(x):
+        return (x.norm(dim=-1, keepdim=True) < 0.5).float()
+
+    for step in range(0, 20):
+        estimator._update(step, occ_eval_fn, warmup_steps=10, cuda_graph=True)
+    graph = estimator._update_graph[1]
+    for step in range(20, 40):
+        estimator._update(step, occ_eval_fn, warmup_steps=10, cuda_graph=True)
+    # the graph is captured once and replayed afterwards.
+    assert estimator._update_graph[1] is graph
+
+    valid = estimator.occs >= 0
+    thre = torch.clamp(estimator.occs[valid].float().mean(), max=0.01)
+    binaries = (estimator.occs > thre.to(estimator.occs.dtype)).view(
+        estimator.binaries.shape
+    )
+    assert (estimator.binaries == binaries).all()
+    assert (estimator.binaries_packed == _pack_binaries(binaries)).all()
+
+    # only the cells within the sphere are occupied.
+    x = (
+        estimator.aabb_lo[:, None]
+        + (estimator.grid_coords.float() + 0.5)
+        / estimator.resolution
+        * estimator.aabb_scale[:, None]
+    )
+    assert not estimator.binaries.view(2, -1)[x.norm(dim=-1) > 0.7].any()
+
+
+@pytest.mark.skipif(not torch.cuda.is_available, reason="No CUDA device")
+def test_load_state_dict():
+    import inspect
+
+    from nerfacc import OccGridEstimator
+    from nerfacc.grid import _pack_binaries
+
+    torch.manual_seed(42)
+    estimator = OccGridEstimator(
+        roi_aabb=[-1.0, -1.0, -1.0, 1.0, 1.0, 1.0], resolution=32, levels=2
+    ).to(device)
+    estimator.occs.copy_(torch.rand_like(estimator.occs))
+    estimator.binaries.copy_(torch.rand_like(estimator.binaries.float()) > 0.5)
+    state_dict = torch.nn.ModuleDict({"grid": estimator}).state_dict()
+
+    # `assign` is only supported since torch 2.1.
+    assigns = [False]
+    if (
+        "assign"
+        in inspect.signature(torch.nn.Module.load_state_dict).parameters
+    ):
+        assigns.append(True)
+    for assign in assigns:
+        # the estimator is loaded as a submodule.
+        _estimator = OccGridEstimator(
+            roi_aabb=[-2.0, -2.0, -2.0, 2.0, 2.0, 2.0], resolution=32, levels=2
+        ).to(device)
+        modules = torch.nn.ModuleDict({"grid": _estimator})
+        if assign:
+            modules.load_state_dict(state_dict, assign=True)
+        else:
+            modules.load_state_dict(state_dict)
+        _estimator = modules["grid"]
+        assert (_estimator.binaries == estimator.binaries).all()
+        assert (
+            _estimator.binaries_packed == _pack_binaries(estimator.binaries)
+        ).all()
+        assert torch.allclose(_estimator.aabb_lo, estimator.aabb_lo)
+        assert torch.allclose(_estimator.aabb_scale, estimator.aabb_scale)
+        assert torch.allclose(
+            _estimator._occs_mean, estimator.occs.mean(dtype=torch.float32)
+        )
+
+
+@pytest.mark.skipif(not torch.cuda.is_available, reason="No CUDA device")
+def test_occs_mean():
+    from nerfacc import OccGridEstimator
+
+    torch.manual_seed(42)
+    estimator = OccGridEstimator(
+        roi_aabb=[-1.0, -1.0, -1.0, 1.0, 1.0, 1.0], resolution=32, levels=2
+    ).to(device)
+
+    def occ_eval_fn(x):
+        return (x.norm(dim=-1, keepdim=True) < 0.5).float()
+
+    estimator._update(0, occ_eval_fn, warmup_steps=10)
+    mean = estimator.occs.mean(dtype=torch.float32)
+    assert torch.allclose(estimator._get_occs_mean(), mean)
+
+    # the mean follows inplace edits and assignments of `occs`.
+    estimator.occs.copy_(torch.rand_like(estimator.occs))
+    mean = estimator.occs.mean(dtype=torch.float32)
+    assert torch.allclose(estimator._get_occs_mean(), mean)
+    estimator.occs = torch.rand_like(estimator.occs)
+    mean = estimator.occs.mean(dtype=torch.float32)
+    assert torch.allclose(estimator._get_occs_mean(), mean)
+
+
 if __name__ == "__main__":
     test_ray_aabb_intersect()
     test_traverse_grids()
+    test_pack_binaries()
     test_traverse_grids_with_near_far_planes()
     test_sampling_with_min_max_distances()
+    test_sampling_with_sorted_rays()
     test_mark_invisible_cells()
     test_traverse_grids_test_mode()
+    test_grid_ema_update()
+    test_update_with_cuda_graph()
+    test_load_state_dict()
+    test_occs_mean()
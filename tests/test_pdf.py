@@ -93,6 +93,19 @@ def test_importance_sampling():
         assert torch.allclose(_intervals.vals[i : i + 1], _vals, atol=1e-4)
         assert torch.allclose(_samples.vals[i : i + 1], _mids, atol=1e-4)
 
+    # write into preallocated buffers
+    out = (
+        torch.empty((5, n_intervels_per_ray + 1), device=device),
+        torch.empty((5, n_intervels_per_ray), device=device),
+    )
+    intervals_out, samples_out = importance_sampling(
+        intervals, cdfs, n_intervels_per_ray, stratified, out=out
+    )
+    assert intervals_out.vals.data_ptr() == out[0].data_ptr()
+    assert samples_out.vals.data_ptr() == out[1].data_ptr()
+    assert torch.allclose(intervals_out.vals, _intervals.vals)
+    assert torch.allclose(samples_out.vals, _samples.vals)
+
 
 @pytest.mark.skipif(not torch.cuda.is_available, reason="No CUDA device")
 def test_pdf_loss():
@@ -126,8 +139,63 @@ def test_pdf_loss():
     )
     assert torch.allclose(loss, loss2, atol=1e-4)
 
+    # flattened intervals
+    def _flatten(intervals, cdfs):
+        n_rays, n_edges = intervals.vals.shape
+        is_left = torch.ones_like(intervals.vals, dtype=torch.bool)
+        is_left[:, -1] = False
+        is_right = torch.ones_like(intervals.vals, dtype=torch.bool)
+        is_right[:, 0] = False
+        chunk_starts = torch.arange(n_rays, device=device) * n_edges
+        chunk_cnts = torch.full_like(chunk_starts, n_edges)
+        intervals = RayIntervals(
+            vals=intervals.vals.flatten(),
+            packed_info=torch.stack([chunk_starts, chunk_cnts], -1),
+            is_left=is_left.flatten(),
+            is_right=is_right.flatten(),
+        )
+        return intervals, cdfs.flatten()
+
+    loss3 = _pdf_loss(*_flatten(intervals, cdfs), *_flatten(_intervals, _cdfs))
+    assert torch.allclose(loss.flatten(), loss3)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available, reason="No CUDA device")
+def test_density_to_cdf():
+    from nerfacc.pdf import _density_to_cdf
+    from nerfacc.volrend import render_transmittance_from_density
+
+    torch.manual_seed(42)
+    n_rays, n_samples = 1000, 100
+    t_vals = torch.sort(torch.rand((n_rays, n_samples + 1), device=device))[0]
+    t_starts = t_vals[:, :-1]
+    t_ends = t_vals[:, 1:]
+    sigmas = torch.rand((n_rays, n_samples), device=device) * 10.0
+
+    trans, _ = render_transmittance_from_density(t_starts, t_ends, sigmas)
+    _cdfs = 1.0 - torch.cat([trans, torch.zeros_like(trans[:, :1])], dim=-1)
+
+    cdfs = _density_to_cdf(t_starts, t_ends, sigmas)
+    assert torch.allclose(cdfs, _cdfs, atol=1e-5)
+
+    out = torch.full((n_rays, n_samples + 1), -1.0, device=device)
+    _density_to_cdf(t_starts, t_ends, sigmas, out=out)
+    assert torch.allclose(out, _cdfs, atol=1e-5)
+
+    # half precision sigmas with a non-unit inner stride, e.g., from autocast.
+    sigmas_half = torch.rand((n_rays, n_samples, 2), device=device) * 10.0
+    sigmas_half = sigmas_half.half()[..., 0]
+    trans, _ = render_transmittance_from_density(
+        t_starts, t_ends, sigmas_half.float()
+    )
+    _cdfs = 1.0 - torch.cat([trans, torch.zeros_like(trans[:, :1])], dim=-1)
+    cdfs = _density_to_cdf(t_starts, t_ends, sigmas_half)
+    assert cdfs.dtype == torch.float32
+    assert torch.allclose(cdfs, _cdfs, atol=1e-5)
+
 
 if __name__ == "__main__":
     test_importance_sampling()
     test_searchsorted()
     test_pdf_loss()
+    test_density_to_cdf()
@@ -33,6 +33,15 @@ def test_render_visibility():
     )
     assert torch.allclose(vis, vis_tgt)
 
+    # alpha_thre as a tensor on device
+    vis = render_visibility_from_alpha(
+        alphas,
+        ray_indices=ray_indices,
+        early_stop_eps=0.05,
+        alpha_thre=torch.tensor(0.35, device=device),
+    )
+    assert torch.allclose(vis, vis_tgt)
+
 
 @pytest.mark.skipif(not torch.cuda.is_available, reason="No CUDA device")
 def test_render_weight_from_alpha():
@@ -105,7 +105,7 @@ def test_base_vdb_estimator():
     for _ in tqdm.trange(1000) if profile else range(1):
         estimator2._update(step=0, occ_eval_fn=occ_eval_fn, occ_thre=occ_thre)
 
-    ijks = estimator1.grid_coords
+    ijks = estimator1.grid_coords.long()
     index = estimator2.grid.ijk_to_index(ijks).jdata
     occs2 = estimator2.occs[index].reshape_as(occs)
     err = (occs - occs2).abs().max()